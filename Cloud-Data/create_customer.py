@@ -1,18 +1,30 @@
-import json
 import os
 import re
 import unicodedata
 import uuid
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
 import boto3
+import orjson
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # ---- Config ----
 TABLE_NAME = os.environ.get("TABLE_NAME", "DanskeBankCustomers")
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(TABLE_NAME)
+REGION = os.environ.get("AWS_REGION", "eu-central-1")
+
+# Resolve credentials during INIT instead of on the first invoke
+_SESSION = boto3.session.Session(region_name=REGION)
+_SESSION.get_credentials()
+# Cliente de bajo nivel: el item PROFILE es plano y de strings, así que
+# construimos los AttributeValue a mano sin pasar por TypeSerializer.
+ddb = _SESSION.client("dynamodb", config=Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 2},
+))
 
 # ---- CORS ----
 CORS_HEADERS = {
@@ -26,47 +38,62 @@ def cors_response(status_code: int, payload: Any):
     return {
         "statusCode": status_code,
         "headers": CORS_HEADERS,
-        "body": json.dumps(payload),
+        "body": orjson.dumps(payload, default=str).decode(),
     }
 
 # ---- Utils ----
+_EMAIL_SANITIZE_RE = re.compile(r"[^a-z0-9.@]")
+
 def normalize_text(s: Optional[str]) -> str:
     if not s:
         return ""
     s = ''.join(ch for ch in unicodedata.normalize("NFD", s) if unicodedata.category(ch) != "Mn")
     return s.strip().lower()
 
+# Sinónimos normalizados -> código ISO (una sola búsqueda, sin cadenas de if)
+COUNTRY_MAP = {
+    "dk": "DK", "danmark": "DK", "denmark": "DK",
+    "se": "SE", "sverige": "SE", "sweden": "SE",
+    "no": "NO", "norge": "NO",   "norway": "NO",
+    "fi": "FI", "suomi": "FI",   "finland": "FI",
+}
+
+# Solo el país se cachea (pocos valores, cortos); los nombres vienen del body
+# de la request sin límite de tamaño y no se cachean.
+@lru_cache(maxsize=64)
+def _country_code_cached(country: str) -> str:
+    return COUNTRY_MAP.get(normalize_text(country), "DK")
+
 def normalize_country(country: Optional[str]) -> str:
     if not country:
         return "DK"
-    c = normalize_text(country)
-    if c in ("dk", "danmark", "denmark"): return "DK"
-    if c in ("se", "sweden", "sverige"):  return "SE"
-    if c in ("no", "norway", "norge"):    return "NO"
-    if c in ("fi", "finland", "suomi"):   return "FI"
-    return "DK"
+    # Una entrada larga nunca es un sinónimo: se resuelve sin ocupar la caché
+    if len(country) > 32:
+        return COUNTRY_MAP.get(normalize_text(country), "DK")
+    return _country_code_cached(country)
 
 def generate_email(first_name: str, last_name: str) -> str:
     fname = normalize_text(first_name).replace(" ", "")
     lname = normalize_text(last_name).replace(" ", "")
-    email = f"{fname}.{lname}@danskebank.com"
     # solo minúsculas, dígitos, punto y @
-    email = re.sub(r"[^a-z0-9.@]", "", email)
-    return email
+    return _EMAIL_SANITIZE_RE.sub("", f"{fname}.{lname}@danskebank.com")
 
 def parse_event_any(e: Any) -> Dict[str, Any]:
     """Acepta dict, string JSON, o proxy {body:'...'} y devuelve dict."""
-    if isinstance(e, dict) and "body" in e:
-        body = e["body"]
-        if isinstance(body, str) and body:
-            try:    return json.loads(body)
-            except json.JSONDecodeError: return {}
-        if isinstance(body, dict): return body
-        return {}
-    if isinstance(e, str):
-        try:    return json.loads(e)
-        except json.JSONDecodeError: return {}
-    return e if isinstance(e, dict) else {}
+    match e:
+        case {"body": str(body)} if body:
+            try:    return orjson.loads(body)
+            except orjson.JSONDecodeError: return {}
+        case {"body": dict(body)}:
+            return body
+        case {"body": _}:
+            return {}
+        case str():
+            try:    return orjson.loads(e)
+            except orjson.JSONDecodeError: return {}
+        case dict():
+            return e
+    return {}
 
 def extract_verification(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -77,27 +104,26 @@ def extract_verification(payload: Dict[str, Any]) -> Dict[str, Any]:
       4) {"statusCode":200,"body":"{...}"}
     Devuelve dict de verificación normalizado.
     """
-    # Caso 1
-    if isinstance(payload.get("verification"), dict):
-        v = payload["verification"]
-        if "body" in v and isinstance(v["body"], str):
-            try:    return json.loads(v["body"])
-            except json.JSONDecodeError: pass
-        return v
-
-    # Caso 4: wrapper HTTP directo
-    if "body" in payload and isinstance(payload["body"], str):
-        try:
-            inner = json.loads(payload["body"])
-            if isinstance(inner, dict) and "status" in inner and "registry_record" in inner:
-                return inner
-            if isinstance(inner.get("verification"), dict):
-                v = inner["verification"]
-                if "body" in v and isinstance(v["body"], str):
-                    return json.loads(v["body"])
-                return v
-        except json.JSONDecodeError:
-            pass
+    match payload:
+        # Caso 3
+        case {"verification": {"body": str(body)} as v}:
+            try:    return orjson.loads(body)
+            except orjson.JSONDecodeError: return v
+        # Caso 1
+        case {"verification": dict(v)}:
+            return v
+        # Caso 4: wrapper HTTP directo
+        case {"body": str(body)}:
+            try:
+                match orjson.loads(body):
+                    case {"status": _, "registry_record": _} as inner:
+                        return inner
+                    case {"verification": {"body": str(vbody)}}:
+                        return orjson.loads(vbody)
+                    case {"verification": dict(v)}:
+                        return v
+            except orjson.JSONDecodeError:
+                pass
 
     # Caso 2
     if "status" in payload and "registry_record" in payload:
@@ -108,11 +134,15 @@ def extract_verification(payload: Dict[str, Any]) -> Dict[str, Any]:
 # ---- Dynamo helpers ----
 def get_existing_customer(pk: str, sk: str = "PROFILE") -> Optional[Dict[str, Any]]:
     try:
-        res = table.get_item(Key={"PK": pk, "SK": sk})
-        return res.get("Item")
+        res = ddb.get_item(TableName=TABLE_NAME, Key={"PK": {"S": pk}, "SK": {"S": sk}})
     except ClientError as e:
         # Propaga el error para que lo maneje el handler
         raise
+    item = res.get("Item")
+    if not item:
+        return None
+    # {"email": {"S": "..."}} -> {"email": "..."}
+    return {k: next(iter(v.values())) for k, v in item.items()}
 
 def put_customer_ddb(item: Dict[str, Any]) -> bool:
     """
@@ -120,8 +150,9 @@ def put_customer_ddb(item: Dict[str, Any]) -> bool:
     Devuelve True si creó; False si ya existía (usando condición).
     """
     try:
-        table.put_item(
-            Item=item,
+        ddb.put_item(
+            TableName=TABLE_NAME,
+            Item={k: {"S": str(v)} for k, v in item.items() if v is not None},
             ConditionExpression="attribute_not_exists(PK)"
         )
         return True
@@ -138,8 +169,8 @@ def handler_core(event) -> Dict[str, Any]:
     if not verification:
         vraw = payload.get("verification")
         if isinstance(vraw, str):
-            try:    verification = json.loads(vraw)
-            except json.JSONDecodeError: pass
+            try:    verification = orjson.loads(vraw)
+            except orjson.JSONDecodeError: pass
 
     if not verification or not isinstance(verification, dict):
         return {"status": "ERROR", "reason": "Missing or invalid verification."}
@@ -160,28 +191,16 @@ def handler_core(event) -> Dict[str, Any]:
         return {"status": "ERROR", "reason": "Missing fields in registry_record."}
 
     # País
-    country_map = {"denmark": "DK", "sweden": "SE", "norway": "NO", "finland": "FI"}
-    country = country_map.get(normalize_text(source), "DK")
+    country = normalize_country(source)
 
     # Claves
     pk = f"{country}#{national_id}"
     sk = "PROFILE"
 
-    # 1) Chequeo idempotente (rápido)
-    existing = get_existing_customer(pk, sk)
-    if existing:
-        return {
-            "status": "ALREADY_REGISTERED",
-            "email": existing.get("email"),
-            "customerId": existing.get("customerId"),
-            "nationalId": existing.get("nationalId"),
-            "country": existing.get("country"),
-            "reason": "El usuario ya está registrado."
-        }
-
-    # 2) Crear (con condición anti-carrera)
+    # Crear directamente: la condición attribute_not_exists(PK) ya garantiza
+    # idempotencia, así que no hace falta un get_item previo.
     created_at = datetime.now(timezone.utc).isoformat()
-    customer_id = str(uuid.uuid4())
+    customer_id = uuid.uuid4().hex  # 32 hex chars, sin guiones
     email = generate_email(first_name, last_name)
 
     item = {
@@ -213,14 +232,14 @@ def handler_core(event) -> Dict[str, Any]:
                 "country": country,
                 "reason": "Customer created from VERIFIED identity."
             }
-        # Si la condición falló por carrera, leemos y devolvemos “ya registrado”
+        # Si la condición falló (ya existía o carrera), leemos y devolvemos “ya registrado”
         existing = get_existing_customer(pk, sk) or {}
         return {
             "status": "ALREADY_REGISTERED",
             "email": existing.get("email", email),
             "customerId": existing.get("customerId"),
-            "nationalId": national_id,
-            "country": country,
+            "nationalId": existing.get("nationalId", national_id),
+            "country": existing.get("country", country),
             "reason": "El usuario ya está registrado."
         }
     except ClientError as e:
@@ -1,15 +1,16 @@
 import os
-import json
 import re
 import base64
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any, Dict, Tuple, List
-import urllib.request
-import urllib.error
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+import orjson
+import urllib3
+from botocore.config import Config
 from botocore.exceptions import ClientError, BotoCoreError
 
 logger = logging.getLogger()
@@ -18,61 +19,117 @@ logger.setLevel(logging.INFO)
 # -------- env --------
 REGION = os.environ.get("AWS_REGION", "eu-central-1")
 WRITE_JSON = os.environ.get("WRITE_JSON", "true").strip().lower() == "true"
+# summary: audit every call, without raw_choice (default)
+# errors:  audit only low-confidence/missing results, with raw_choice
+# full:    audit every call, with raw_choice
+AUDIT_LEVEL = os.environ.get("AUDIT_LEVEL", "summary").strip().lower()
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")  # e.g., gpt-4o, gpt-4o-mini
 OPENAI_TIMEOUT = int(os.environ.get("OPENAI_TIMEOUT_SEC", "40"))
 OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
 
-s3 = boto3.client("s3", region_name=REGION)
+# Resolve credentials during INIT instead of on the first invoke
+_SESSION = boto3.session.Session(region_name=REGION)
+_SESSION.get_credentials()
+
+s3 = _SESSION.client("s3", config=Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 2},
+))
+
+# Keep-alive pool for api.openai.com: warm containers skip the TLS handshake.
+# Retries are handled by the strict/fallback attempts and OPENAI_MAX_RETRIES.
+_HTTP = urllib3.PoolManager(num_pools=2, maxsize=4, retries=False)
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
 
 # ------------------------ helpers ------------------------
 
 def _parse_event(e: Any) -> Dict[str, Any]:
     """Accept dict, {body:'...'}, or raw JSON string."""
-    if isinstance(e, dict) and "body" in e:
-        b = e["body"]
-        if isinstance(b, str) and b:
+    match e:
+        case {"body": str(b)} if b:
             try:
-                return json.loads(b)
-            except json.JSONDecodeError:
+                return orjson.loads(b)
+            except orjson.JSONDecodeError:
                 return {}
-        if isinstance(b, dict):
+        case {"body": dict(b)}:
             return b
-        return {}
-    if isinstance(e, str):
-        try:
-            return json.loads(e)
-        except json.JSONDecodeError:
+        case {"body": _}:
             return {}
-    return e if isinstance(e, dict) else {}
+        case str():
+            try:
+                return orjson.loads(e)
+            except orjson.JSONDecodeError:
+                return {}
+        case dict():
+            return e
+    return {}
 
-def _get_obj_bytes(bucket: str, key: str) -> bytes:
+def _stream_obj_to_b64(bucket: str, key: str) -> bytearray:
+    """Base64-encodes the object as it streams off the socket (no raw copy kept)."""
     obj = s3.get_object(Bucket=bucket, Key=key)
-    return obj["Body"].read()
+    out = bytearray()
+    rest = b""
+    for chunk in obj["Body"].iter_chunks(chunk_size=64 * 1024):
+        if rest:
+            chunk = rest + chunk
+        # encode only whole 3-byte groups; carry the remainder to the next chunk
+        cut = len(chunk) - len(chunk) % 3
+        out += base64.b64encode(memoryview(chunk)[:cut])
+        rest = chunk[cut:]
+    out += base64.b64encode(rest)
+    return out
+
+# "YYYY/MM/DD" for the current UTC day, reformatted only when the day rolls over.
+_date_cache = {"until": 0.0, "s": ""}
+
+def _utc_date_path() -> str:
+    now = time.time()
+    if now >= _date_cache["until"]:
+        _date_cache["s"] = f"{datetime.now(timezone.utc):%Y/%m/%d}"
+        _date_cache["until"] = now - now % 86400 + 86400  # next UTC midnight
+    return _date_cache["s"]
 
 def _find_key_by_session(bucket: str, country: str, session_id: str) -> str:
     """Finds latest object under today's prefix that contains the sessionId."""
-    today = datetime.utcnow()
-    prefix = f"onboard/{(country or 'SE').upper()}/{today:%Y/%m/%d}/{session_id}/"
+    prefix = f"onboard/{(country or 'SE').upper()}/{_utc_date_path()}/{session_id}/"
     resp = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
     items = resp.get("Contents") or []
     if not items:
         return ""
-    return sorted(items, key=lambda x: x["LastModified"], reverse=True)[0]["Key"]
+    return max(items, key=lambda x: x["LastModified"])["Key"]
+
+# Routine audit writes run off the response path and are best-effort: once the
+# handler returns the container may be frozen, so an in-flight PUT can fail
+# after the thaw (the socket is usually gone) or never run if the container is
+# reclaimed. Audits that need review are written inline instead (see handler).
+_AUDIT_POOL = ThreadPoolExecutor(max_workers=1)
+
+def _put_audit(bucket: str, key: str, audit: Dict[str, Any]) -> None:
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{key}.extracted.json",
+            Body=orjson.dumps(audit),
+            ContentType="application/json",
+        )
+    except Exception as e:
+        logger.warning("audit write failed: %s", e)
 
 # -------------------- country patterns & normalization ----------------------
 
+# Compiled once during INIT and reused across warm invocations.
+_COUNTRY_RE: Dict[str, re.Pattern] = {
+    "SE": re.compile(r"\b(?:\d{6}|\d{8})-?\d{4}\b"),            # YYMMDD-XXXX or YYYYMMDD-XXXX
+    "DK": re.compile(r"\b\d{6}-?\d{4}\b"),                      # DDMMYY-XXXX
+    "NO": re.compile(r"\b\d{11}\b"),                            # 11 digits
+    "FI": re.compile(r"\b\d{6}[-+A][0-9A-Za-z]{4}\b", re.I),    # DDMMYY[-+A]XXXX
+}
+_NO_MATCH_RE = re.compile(r".^")
+
 def _regex_for_country(country: str) -> re.Pattern:
-    c = (country or "SE").upper()
-    if c == "SE":
-        return re.compile(r"\b(?:\d{6}|\d{8})-?\d{4}\b")            # YYMMDD-XXXX or YYYYMMDD-XXXX
-    if c == "DK":
-        return re.compile(r"\b\d{6}-?\d{4}\b")                      # DDMMYY-XXXX
-    if c == "NO":
-        return re.compile(r"\b\d{11}\b")                            # 11 digits
-    if c == "FI":
-        return re.compile(r"\b\d{6}[-+A][0-9A-Za-z]{4}\b", re.I)    # DDMMYY[-+A]XXXX
-    return re.compile(r".^")  # no match
+    return _COUNTRY_RE.get((country or "SE").upper(), _NO_MATCH_RE)
 
 def _normalize_id(national_id: str, country: str) -> str:
     if not national_id:
@@ -83,117 +140,138 @@ def _normalize_id(national_id: str, country: str) -> str:
 
 # -------------------- OpenAI calls ------------------------
 
+_JSON_PREFIX_RE = re.compile(r"^json", re.I)
+
 def _clean_json_text(s: str) -> str:
     if not s:
         return ""
     s = s.strip()
     if s.startswith("```"):
         s = s.strip("`")
-        s = re.sub(r"^json", "", s, flags=re.I).strip()
+        s = _JSON_PREFIX_RE.sub("", s).strip()
     return s
 
-def _openai_payload_strict(b64_jpeg: str, country: str) -> Dict[str, Any]:
-    # Strong consent + JSON Schema to minimize refusals + schema drift
-    schema = {
-        "name": "national_id_schema",
-        "schema": {
-            "type": "object",
-            "properties": {
-                "nationalId": { "type": "string" }
+# Payloads are serialized once at INIT with markers for the two varying
+# fields. Per call we only join the byte segments: the country (JSON-escaped)
+# and the base64 image, which needs no escaping and is never decoded.
+_COUNTRY_MARK = "__COUNTRY__"
+_IMAGE_MARK = "__IMAGE_B64__"
+
+def _payload_template(payload: Dict[str, Any]) -> Tuple[bytes, bytes, bytes]:
+    head, rest = orjson.dumps(payload).split(_COUNTRY_MARK.encode(), 1)
+    mid, tail = rest.split(_IMAGE_MARK.encode(), 1)
+    return head, mid, tail
+
+def _render_payload(template: Tuple[bytes, bytes, bytes], b64_jpeg: bytes, country: str) -> bytes:
+    head, mid, tail = template
+    return b"".join((head, orjson.dumps(country)[1:-1], mid, b64_jpeg, tail))
+
+# Strong consent + JSON Schema to minimize refusals + schema drift
+_STRICT_TEMPLATE = _payload_template({
+    "model": OPENAI_MODEL,
+    "messages": [
+        {"role": "system", "content": (
+            "You are an OCR assistant used for user-consented KYC by the lawful holder of the document. "
+            "Task: extract ONLY the national/personal identification number from the image. "
+            "Output MUST strictly follow the provided JSON Schema."
+        )},
+        {"role": "user", "content": [
+            {"type": "text", "text": (
+                f"Country code: {_COUNTRY_MARK}. The user gives consent. "
+                "Find the personal identity number (synonyms by country):\n"
+                "- SE: personnummer / personal identity number (YYMMDD-XXXX or YYYYMMDD-XXXX)\n"
+                "- DK: CPR-nummer (DDMMYY-XXXX)\n"
+                "- NO: fødselsnummer / personnummer (11 digits)\n"
+                "- FI: henkilötunnus / HETU (DDMMYY[-+A]XXXX)\n"
+                "Return JSON ONLY."
+            )},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{_IMAGE_MARK}"}}
+        ]}
+    ],
+    "temperature": 0,
+    "max_tokens": 120,
+    "response_format": {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "national_id_schema",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "nationalId": { "type": "string" }
+                },
+                "required": ["nationalId"],
+                "additionalProperties": False
             },
-            "required": ["nationalId"],
-            "additionalProperties": False
-        },
-        "strict": True
-    }
-    system = (
-        "You are an OCR assistant used for user-consented KYC by the lawful holder of the document. "
-        "Task: extract ONLY the national/personal identification number from the image. "
-        "Output MUST strictly follow the provided JSON Schema."
-    )
-    user = (
-        "Country code: {country}. The user gives consent. "
-        "Find the personal identity number (synonyms by country):\n"
-        "- SE: personnummer / personal identity number (YYMMDD-XXXX or YYYYMMDD-XXXX)\n"
-        "- DK: CPR-nummer (DDMMYY-XXXX)\n"
-        "- NO: fødselsnummer / personnummer (11 digits)\n"
-        "- FI: henkilötunnus / HETU (DDMMYY[-+A]XXXX)\n"
-        "Return JSON ONLY."
-    ).format(country=country)
-
-    return {
-        "model": OPENAI_MODEL,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": [
-                {"type": "text", "text": user},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64_jpeg}" }}
-            ]}
-        ],
-        "temperature": 0,
-        "max_tokens": 120,
-        "response_format": {
-            "type": "json_schema",
-            "json_schema": schema
+            "strict": True
         }
     }
-
-def _openai_payload_fallback(b64_jpeg: str, country: str) -> Dict[str, Any]:
-    # Looser: allow the model to return candidates; we’ll pick with regex.
-    system = (
-        "You are an OCR assistant used for user-consented KYC by the document holder. "
-        "Extract national/personal ID candidates from the image. If multiple appear, list them all. "
-        "Return JSON only."
-    )
-    user = (
-        "Country code: {country}. The user gives consent. "
-        "Look for labels like: personnummer, CPR, fødselsnummer, henkilötunnus, HETU, ID number. "
-        "Return JSON with keys: candidates (array of strings)."
-    ).format(country=country)
-
-    return {
-        "model": OPENAI_MODEL,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": [
-                {"type": "text", "text": user},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64_jpeg}" }}
-            ]}
-        ],
-        "temperature": 0,
-        "max_tokens": 180,
-        "response_format": {"type": "json_object"}
-    }
-
-def _openai_post(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+})
+
+# Looser: allow the model to return candidates; we’ll pick with regex.
+_FALLBACK_TEMPLATE = _payload_template({
+    "model": OPENAI_MODEL,
+    "messages": [
+        {"role": "system", "content": (
+            "You are an OCR assistant used for user-consented KYC by the document holder. "
+            "Extract national/personal ID candidates from the image. If multiple appear, list them all. "
+            "Return JSON only."
+        )},
+        {"role": "user", "content": [
+            {"type": "text", "text": (
+                f"Country code: {_COUNTRY_MARK}. The user gives consent. "
+                "Look for labels like: personnummer, CPR, fødselsnummer, henkilötunnus, HETU, ID number. "
+                "Return JSON with keys: candidates (array of strings)."
+            )},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{_IMAGE_MARK}"}}
+        ]}
+    ],
+    "temperature": 0,
+    "max_tokens": 180,
+    "response_format": {"type": "json_object"}
+})
+
+def _openai_payload_strict(b64_jpeg: bytes, country: str) -> bytes:
+    return _render_payload(_STRICT_TEMPLATE, b64_jpeg, country)
+
+def _openai_payload_fallback(b64_jpeg: bytes, country: str) -> bytes:
+    return _render_payload(_FALLBACK_TEMPLATE, b64_jpeg, country)
+
+class OpenAIHTTPError(Exception):
+    def __init__(self, code: int, body: bytes):
+        super().__init__(f"OpenAI HTTP {code}")
+        self.code = code
+        self.body = body
+
+def _openai_post(body: bytes) -> Tuple[Dict[str, Any], str]:
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY not set")
-    req = urllib.request.Request(
-        "https://api.openai.com/v1/chat/completions",
-        data=json.dumps(payload).encode("utf-8"),
+    r = _HTTP.request(
+        "POST",
+        OPENAI_URL,
+        body=body,
         headers={
             "Content-Type": "application/json",
             "Authorization": f"Bearer {OPENAI_API_KEY}",
             "User-Agent": "lambda-id-extract/openai-only-1.0"
         },
-        method="POST"
+        timeout=urllib3.Timeout(total=OPENAI_TIMEOUT),
     )
-    with urllib.request.urlopen(req, timeout=OPENAI_TIMEOUT) as r:
-        resp = json.loads(r.read().decode("utf-8"))
+    if r.status >= 400:
+        raise OpenAIHTTPError(r.status, r.data)
+    resp = orjson.loads(r.data)
     choice = (resp.get("choices") or [{}])[0]
     msg = choice.get("message") or {}
     content = msg.get("content")
     refusal = msg.get("refusal")
-    return {"content": content, "refusal": refusal}, json.dumps(resp)  # raw for audit
+    return {"content": content, "refusal": refusal}, orjson.dumps(resp).decode()  # raw for audit
 
-def _extract_national_id_via_openai(img_bytes: bytes, country: str) -> Tuple[str, float, Dict[str, Any]]:
+def _extract_national_id_via_openai(b64: bytes, country: str) -> Tuple[str, float, Dict[str, Any]]:
     """
     Returns (national_id, confidence, debug_info)
     Two attempts:
       1) strict JSON schema with single nationalId
       2) fallback candidates array; we pick with regex
     """
-    b64 = base64.b64encode(img_bytes).decode("utf-8")
     patt = _regex_for_country(country)
 
     # Attempt 1: strict
@@ -203,7 +281,7 @@ def _extract_national_id_via_openai(img_bytes: bytes, country: str) -> Tuple[str
         text = msg.get("content")
         if text:
             clean = _clean_json_text(text)
-            data = json.loads(clean)
+            data = orjson.loads(clean)
             nid = (data.get("nationalId") or "").strip()
             if nid:
                 m = patt.search(nid)
@@ -215,8 +293,8 @@ def _extract_national_id_via_openai(img_bytes: bytes, country: str) -> Tuple[str
                     return _normalize_id(m2.group(0), country), 0.88, {"attempt":"strict-recovered", "raw": raw_resp}
         else:
             logger.warning("OpenAI strict attempt returned content=None; refusal=%s", msg.get("refusal"))
-    except urllib.error.HTTPError as e:
-        logger.warning("OpenAI HTTPError strict %s: %s", e.code, e.read().decode("utf-8", "ignore"))
+    except OpenAIHTTPError as e:
+        logger.warning("OpenAI HTTPError strict %s: %s", e.code, e.body.decode("utf-8", "ignore"))
     except Exception as e:
         logger.warning("OpenAI strict attempt failed: %s", e)
 
@@ -228,7 +306,7 @@ def _extract_national_id_via_openai(img_bytes: bytes, country: str) -> Tuple[str
         clean2 = _clean_json_text(text2)
         cand = []
         try:
-            data2 = json.loads(clean2)
+            data2 = orjson.loads(clean2)
             cand = data2.get("candidates") or []
             if isinstance(cand, str):
                 cand = [cand]
@@ -249,8 +327,8 @@ def _extract_national_id_via_openai(img_bytes: bytes, country: str) -> Tuple[str
 
         logger.warning("OpenAI fallback produced no valid candidate.")
         return "", 0.0, {"attempt":"fallback-none", "raw": raw_resp2}
-    except urllib.error.HTTPError as e:
-        logger.warning("OpenAI HTTPError fallback %s: %s", e.code, e.read().decode("utf-8", "ignore"))
+    except OpenAIHTTPError as e:
+        logger.warning("OpenAI HTTPError fallback %s: %s", e.code, e.body.decode("utf-8", "ignore"))
     except Exception as e:
         logger.warning("OpenAI fallback attempt failed: %s", e)
 
@@ -270,7 +348,7 @@ def lambda_handler(event, context):
     """
     try:
         payload = _parse_event(event)
-        logger.info("event=%s", json.dumps(payload))
+        logger.info("event=%s", orjson.dumps(payload, default=str).decode())
 
         bucket    = payload.get("bucket")
         key       = payload.get("key") or payload.get("keyPrefix")
@@ -284,14 +362,14 @@ def lambda_handler(event, context):
         if not key:
             return {"status": "ERROR", "reason": "key or sessionId is required (no image found)"}
 
-        img_bytes = _get_obj_bytes(bucket, key)
+        img_b64 = _stream_obj_to_b64(bucket, key)
 
         # --- OpenAI only, with retry backoff ---
         national_id = ""
         confidence = 0.0
         debug = {}
         for attempt in range(OPENAI_MAX_RETRIES):
-            nid, conf, dbg = _extract_national_id_via_openai(img_bytes, country)
+            nid, conf, dbg = _extract_national_id_via_openai(img_b64, country)
             debug = dbg
             if nid:
                 national_id, confidence = nid, conf
@@ -301,7 +379,8 @@ def lambda_handler(event, context):
 
         identity = {"nationalId": national_id or "", "country": country}
 
-        if WRITE_JSON:
+        needs_review = not national_id or confidence < 0.8
+        if WRITE_JSON and (AUDIT_LEVEL != "errors" or needs_review):
             try:
                 audit = {
                     "openai_model": OPENAI_MODEL,
@@ -311,19 +390,19 @@ def lambda_handler(event, context):
                     "source": {"bucket": bucket, "key": key},
                 }
                 # Limit raw dump size if present
-                raw_dump = debug.get("raw")
+                raw_dump = debug.get("raw") if AUDIT_LEVEL != "summary" else None
                 if raw_dump and len(raw_dump) > 10000:
                     raw_dump = raw_dump[:10000] + "...<truncated>"
                 if raw_dump:
                     audit["raw_choice"] = raw_dump
-                s3.put_object(
-                    Bucket=bucket,
-                    Key=f"{key}.extracted.json",
-                    Body=json.dumps(audit, ensure_ascii=False).encode("utf-8"),
-                    ContentType="application/json",
-                )
+                if needs_review:
+                    # Missing/low-confidence IDs are the records meant for review:
+                    # write them before returning so a freeze cannot drop them
+                    _put_audit(bucket, key, audit)
+                else:
+                    _AUDIT_POOL.submit(_put_audit, bucket, key, audit)
             except Exception as e:
-                logger.warning("audit write failed: %s", e)
+                logger.warning("audit not written: %s", e)
 
         if not identity["nationalId"]:
             return {
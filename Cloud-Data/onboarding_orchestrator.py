@@ -1,7 +1,19 @@
-import os, json, boto3
+import os, boto3, orjson
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
-LAMBDA = boto3.client("lambda")
+REGION = os.environ.get("AWS_REGION", "eu-central-1")
+
+# Resolve credentials during INIT instead of on the first invoke
+_SESSION = boto3.session.Session(region_name=REGION)
+_SESSION.get_credentials()
+
+# Pooled keep-alive connections: the auto-chain makes up to 3 sequential invokes
+LAMBDA = _SESSION.client("lambda", config=Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 2},
+))
 
 def _env(n):
     v = os.environ.get(n)
@@ -18,8 +30,19 @@ MAP = {
 
 DEFAULT_BUCKET = os.environ.get("UPLOAD_BUCKET", "")
 
+# ---- Optional Step Functions Express chain (onboarding_chain.asl.json) ----
+# When set, extract -> verify -> create runs as one StartSyncExecution call
+# instead of three nested Lambda invokes. Direct calls stay plain invokes.
+STATE_MACHINE_ARN = os.environ.get("ONBOARDING_STATE_MACHINE_ARN", "")
+SFN = _SESSION.client("stepfunctions", config=Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    read_timeout=300,  # sync Express executions can run up to 5 min
+    retries={"mode": "standard", "max_attempts": 1},  # never re-run the whole chain
+)) if STATE_MACHINE_ARN else None
+
 def _safe_json_loads(s):
-    try: return json.loads(s)
+    try: return orjson.loads(s)
     except Exception: return None
 
 def _params_to_dict(p):
@@ -33,16 +56,16 @@ def _params_to_dict(p):
     return out
 
 def _unwrap_child_result(o):
-    if isinstance(o, dict) and "body" in o:
-        b = o["body"]
-        if isinstance(b, dict): return b
-        if isinstance(b, str):
-            j = _safe_json_loads(b)
-            if isinstance(j, dict):
-                if "body" in j and isinstance(j["body"], str):
-                    j2 = _safe_json_loads(j["body"])
+    match o:
+        case {"body": dict(b)}:
+            return b
+        case {"body": str(b)}:
+            match _safe_json_loads(b):
+                case {"body": str(b2)} as j:
+                    j2 = _safe_json_loads(b2)
                     return j2 if isinstance(j2, dict) else j
-                return j
+                case dict(j):
+                    return j
             return {"_raw_body": b}
     return o
 
@@ -51,17 +74,38 @@ def _invoke_child(arn, payload):
         r = LAMBDA.invoke(
             FunctionName=arn,
             InvocationType="RequestResponse",
-            Payload=json.dumps(payload).encode("utf-8"),
+            Payload=orjson.dumps(payload),
         )
         raw = r.get("Payload").read()
-        data = _safe_json_loads(raw.decode("utf-8", errors="replace"))
+        data = _safe_json_loads(raw)  # orjson parses the bytes directly; decode only for the fallback
         return _unwrap_child_result(data if data is not None else {"_raw": raw.decode("utf-8", "replace")})
     except Exception as e:
         return {"error": "INVOKE_EXCEPTION", "detail": str(e), "calledArn": arn, "payload": payload}
 
+def _chain_step_result(res):
+    # Caught Task errors arrive as {"Error","Cause"}; report them like _invoke_child does
+    match res:
+        case {"Error": str(err)}:
+            return {"error": "INVOKE_EXCEPTION", "detail": res.get("Cause") or err}
+    return res
+
+def _run_chain(params):
+    """Runs the Express workflow; returns (extract, verify, create) like the direct chain."""
+    try:
+        r = SFN.start_sync_execution(
+            stateMachineArn=STATE_MACHINE_ARN,
+            input=orjson.dumps(params).decode(),
+        )
+    except Exception as e:
+        return {"error": "CHAIN_EXCEPTION", "detail": str(e), "calledArn": STATE_MACHINE_ARN, "payload": params}, None, None
+    if r.get("status") != "SUCCEEDED":
+        return {"error": f"CHAIN_{r.get('status')}", "detail": r.get("error"), "cause": r.get("cause")}, None, None
+    out = _safe_json_loads(r.get("output") or "") or {}
+    return out.get("extract") or {}, _chain_step_result(out.get("verify")), _chain_step_result(out.get("create"))
+
 def _wrap_for_bedrock(event, fn, body_obj, session, prompt, state=None):
     try:
-        txt = json.dumps(body_obj, separators=(",", ":")) if not isinstance(body_obj, str) else body_obj
+        txt = orjson.dumps(body_obj).decode() if not isinstance(body_obj, str) else body_obj
     except Exception:
         txt = str(body_obj)
     resp = {"responseBody": {"TEXT": {"body": txt}}}
@@ -110,7 +154,12 @@ def lambda_handler(event, context):
         if base == "extract_id_from_s3":
             params = _merge_defaults_for_extract(params, sess)
 
-        child = _invoke_child(MAP[base], params)
+        verify_res = None
+        create_res = None
+        if base == "extract_id_from_s3" and SFN is not None:
+            child, verify_res, create_res = _run_chain(params)
+        else:
+            child = _invoke_child(MAP[base], params)
 
         # ---- Auto-chain: extract -> verify -> create ----
         if base == "extract_id_from_s3" and isinstance(child, dict):
@@ -120,24 +169,22 @@ def lambda_handler(event, context):
             nid = (identity.get("nationalId") or "").strip()
             country = identity.get("country") or params.get("country") or sess.get("country")
 
-            verify_res = None
-            create_res = None
-
-            if (child.get("status") == "OK") and nid and country:
+            if SFN is None and (child.get("status") == "OK") and nid and country:
                 # VERIFY
                 verify_payload = {"nationalId": nid, "country": country}
                 verify_res = _invoke_child(MAP["verify_identity"], verify_payload)
 
                 if isinstance(verify_res, dict) and verify_res.get("status") == "VERIFIED":
                     # VERIFIED -> CREATE
-                    sess["verificationStatus"] = "VERIFIED"
-                    prompt["verified.last4"] = nid[-4:]
-                    prompt["verified.country"] = country
-
                     create_payload = {"verification": verify_res}
                     create_res = _invoke_child(MAP["create_customer"], create_payload)
-                else:
-                    sess["verificationStatus"] = "UPLOADED"
+
+            if isinstance(verify_res, dict) and verify_res.get("status") == "VERIFIED":
+                sess["verificationStatus"] = "VERIFIED"
+                prompt["verified.last4"] = nid[-4:]
+                prompt["verified.country"] = country
+            elif verify_res is not None:
+                sess["verificationStatus"] = "UPLOADED"
 
             body = {
                 "extract": child,
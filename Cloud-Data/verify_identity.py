@@ -1,10 +1,24 @@
-import json
+import logging
+import re
 import unicodedata
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, Final, Mapping, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 # --- Registros mock embebidos (referencias nacionales) ---
 
-DK_CPR_REGISTRY: Dict[str, Dict[str, Any]] = {
+# Ciudadanía compartida por todos los registros de cada país (tuplas inmutables)
+_CIT_DK = ("Denmark",)
+_CIT_SE = ("Sweden",)
+_CIT_NO = ("Norway",)
+_CIT_FI = ("Finland",)
+
+DK_CPR_REGISTRY: Mapping[str, Mapping[str, Any]] = {
     "123456-7890": {
         "firstName": "John",
         "lastName": "Doe",
@@ -12,7 +26,7 @@ DK_CPR_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "male",
         "address": "POC Street 1, 2100 Copenhagen",
         "maritalStatus": "married",
-        "citizenship": ["Denmark"],
+        "citizenship": _CIT_DK,
     },
     "160778-1234": {
         "firstName": "Maria",
@@ -21,11 +35,11 @@ DK_CPR_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "female",
         "address": "Hovedgaden 10, 8000 Aarhus",
         "maritalStatus": "single",
-        "citizenship": ["Denmark"],
+        "citizenship": _CIT_DK,
     },
 }
 
-SE_SPAR_REGISTRY: Dict[str, Dict[str, Any]] = {
+SE_SPAR_REGISTRY: Mapping[str, Mapping[str, Any]] = {
     "19800101-1230": {
         "firstName": "Anna",
         "lastName": "Svensson",
@@ -33,7 +47,7 @@ SE_SPAR_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "female",
         "address": "Storgatan 1, 111 22 Stockholm",
         "maritalStatus": "married",
-        "citizenship": ["Sweden"],
+        "citizenship": _CIT_SE,
     },
     "19950715-8899": {
         "firstName": "Erik",
@@ -42,7 +56,7 @@ SE_SPAR_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "male",
         "address": "Västra Hamngatan 5, 411 17 Göteborg",
         "maritalStatus": "single",
-        "citizenship": ["Sweden"],
+        "citizenship": _CIT_SE,
     },
     "860714-1556": {
         "firstName": "Juan Pablo Rafael",
@@ -51,11 +65,11 @@ SE_SPAR_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "male",
         "address": "Molnvadersgatan 8",
         "maritalStatus": "single",
-        "citizenship": ["Sweden"],
+        "citizenship": _CIT_SE,
     },
 }
 
-NO_FOLKEREGISTER: Dict[str, Dict[str, Any]] = {
+NO_FOLKEREGISTER: Mapping[str, Mapping[str, Any]] = {
     "47010112345": {
         "firstName": "Ola",
         "lastName": "Nordmann",
@@ -63,7 +77,7 @@ NO_FOLKEREGISTER: Dict[str, Dict[str, Any]] = {
         "gender": "male",
         "address": "Karl Johans gate 1, 0154 Oslo",
         "maritalStatus": "single",
-        "citizenship": ["Norway"],
+        "citizenship": _CIT_NO,
     },
     "47020254321": {
         "firstName": "Kari",
@@ -72,11 +86,11 @@ NO_FOLKEREGISTER: Dict[str, Dict[str, Any]] = {
         "gender": "female",
         "address": "Bygdøy allé 20, 0262 Oslo",
         "maritalStatus": "married",
-        "citizenship": ["Norway"],
+        "citizenship": _CIT_NO,
     },
 }
 
-FI_POPULATION_REGISTRY: Dict[str, Dict[str, Any]] = {
+FI_POPULATION_REGISTRY: Mapping[str, Mapping[str, Any]] = {
     "FI-120394-123X": {
         "firstName": "Matti",
         "lastName": "Korhonen",
@@ -84,7 +98,7 @@ FI_POPULATION_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "male",
         "address": "Mannerheimintie 10, 00100 Helsinki",
         "maritalStatus": "married",
-        "citizenship": ["Finland"],
+        "citizenship": _CIT_FI,
     },
     "FI-010180-999Y": {
         "firstName": "Liisa",
@@ -93,144 +107,243 @@ FI_POPULATION_REGISTRY: Dict[str, Dict[str, Any]] = {
         "gender": "female",
         "address": "Hämeenkatu 5, 33100 Tampere",
         "maritalStatus": "single",
-        "citizenship": ["Finland"],
+        "citizenship": _CIT_FI,
     },
 }
 
 # --- CORS helpers (AÑADIDO) ---
-CORS_HEADERS = {
+# dict normal (no MappingProxyType): el runtime de Lambda serializa la respuesta
+# con json estándar, que no acepta mappingproxy. Se comparte entre respuestas.
+CORS_HEADERS: Final[Dict[str, str]] = {
     "Content-Type": "application/json",
     "Access-Control-Allow-Origin": "*",
     "Access-Control-Allow-Headers": "Content-Type,Authorization,X-Requested-With,X-Amz-Date,X-Api-Key,X-Amz-Security-Token",
     "Access-Control-Allow-Methods": "POST,OPTIONS",
 }
 
-def cors_response(status_code: int, payload: Any):
-    return {
-        "statusCode": status_code,
-        "headers": CORS_HEADERS,
-        "body": json.dumps(payload),
-    }
+# Respuesta 200 base (solo falta el body): copiarla es más barato que el literal
+_OK_SHELL: Final[Dict[str, Any]] = {"statusCode": 200, "headers": CORS_HEADERS}
+
+def cors_response(status_code: int, payload: Any) -> Dict[str, Any]:
+    r = _OK_SHELL.copy() if status_code == 200 else {"statusCode": status_code, "headers": CORS_HEADERS}
+    r["body"] = orjson.dumps(payload).decode()
+    return r
+
+# Respuesta fija del preflight CORS (el runtime no la modifica, se puede compartir)
+_OPTIONS_RESPONSE: Final[Dict[str, Any]] = {"statusCode": 200, "headers": CORS_HEADERS, "body": '{"ok": true}'}
 
 # --- Funciones auxiliares ---
 
+# Marcas diacríticas combinantes (Mn) que aparecen en nombres latinos/nórdicos
+_COMBINING_RE: Final = re.compile(r"[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
 def normalize_text(s: Optional[str]) -> str:
     """Quita tildes, espacios y pone en minúscula para comparar."""
     if not s:
         return ""
-    s = ''.join(ch for ch in unicodedata.normalize("NFD", s) if unicodedata.category(ch) != "Mn")
-    return s.strip().lower()
+    return _COMBINING_RE.sub("", unicodedata.normalize("NFD", s)).strip().lower()
+
+# Alias normalizado -> código ISO
+_COUNTRY_ALIASES: Final[Dict[str, str]] = {
+    "dk": "DK", "danmark": "DK", "denmark": "DK",
+    "se": "SE", "sverige": "SE", "sweden": "SE",
+    "no": "NO", "norge": "NO",   "norway": "NO",
+    "fi": "FI", "suomi": "FI",   "finland": "FI",
+}
+
+# Solo el país se cachea: pocos valores distintos y cortos. Los nombres vienen
+# de la request sin límite de tamaño y no se cachean.
+@lru_cache(maxsize=64)
+def _country_code_cached(country: str) -> str:
+    return _COUNTRY_ALIASES.get(normalize_text(country), "DK")
 
 def normalize_country(country: Optional[str]) -> str:
     """Acepta abreviaciones y nombres en varios idiomas."""
     if not country:
         return "DK"
-    c = normalize_text(country)
-    if c in ("dk", "danmark", "denmark"): return "DK"
-    if c in ("se", "sweden", "sverige"):  return "SE"
-    if c in ("no", "norway", "norge"):    return "NO"
-    if c in ("fi", "finland", "suomi"):   return "FI"
-    return "DK"
-
-def compare_optional_fields(registry: Dict[str, Any],
+    # Una entrada larga nunca es un alias: se resuelve sin ocupar la caché
+    if len(country) > 32:
+        return _COUNTRY_ALIASES.get(normalize_text(country), "DK")
+    return _country_code_cached(country)
+
+def compare_optional_fields(registry: Mapping[str, Any],
                             firstName: Optional[str],
                             lastName: Optional[str],
                             dateOfBirth: Optional[str]) -> Optional[str]:
     """Verifica coherencia de campos opcionales."""
-    if firstName and normalize_text(firstName) != normalize_text(registry.get("firstName")):
+    # Igualdad exacta primero: evita normalizar en el caso habitual
+    if firstName and firstName != registry["firstName"] and normalize_text(firstName) != registry["_fn_norm"]:
         return f"First name mismatch (got '{firstName}', expected '{registry.get('firstName')}')."
-    if lastName and normalize_text(lastName) != normalize_text(registry.get("lastName")):
+    if lastName and lastName != registry["lastName"] and normalize_text(lastName) != registry["_ln_norm"]:
         return f"Last name mismatch (got '{lastName}', expected '{registry.get('lastName')}')."
     if dateOfBirth and dateOfBirth.strip() != registry.get("dateOfBirth"):
         return f"Date of birth mismatch (got '{dateOfBirth}', expected '{registry.get('dateOfBirth')}')."
     return None
 
+def public_record(national_id: str, p: Mapping[str, Any]) -> Dict[str, Any]:
+    """Registro para la respuesta: esquema fijo, sin las claves internas (_fn_norm, _ln_norm)."""
+    return {
+        "national_id": national_id,
+        "firstName": p["firstName"],
+        "lastName": p["lastName"],
+        "dateOfBirth": p["dateOfBirth"],
+        "gender": p["gender"],
+        "address": p["address"],
+        "maritalStatus": p["maritalStatus"],
+        "citizenship": p["citizenship"],  # tupla compartida del registro, sin copiar
+    }
+
+def _freeze_registry(reg: Mapping[str, Mapping[str, Any]]) -> Mapping[str, Mapping[str, Any]]:
+    """Registro de solo lectura; cada ficha lleva sus nombres normalizados (_fn_norm, _ln_norm)."""
+    return MappingProxyType({
+        nid: MappingProxyType({
+            **rec,
+            "_fn_norm": normalize_text(rec["firstName"]),
+            "_ln_norm": normalize_text(rec["lastName"]),
+        })
+        for nid, rec in reg.items()
+    })
+
+# Registros congelados al cargar el módulo (nombres normalizados una sola vez)
+DK_CPR_REGISTRY = _freeze_registry(DK_CPR_REGISTRY)
+SE_SPAR_REGISTRY = _freeze_registry(SE_SPAR_REGISTRY)
+NO_FOLKEREGISTER = _freeze_registry(NO_FOLKEREGISTER)
+FI_POPULATION_REGISTRY = _freeze_registry(FI_POPULATION_REGISTRY)
+
+# País -> (fuente, registro)
+_REGISTRY_BY_COUNTRY: Final[Dict[str, Tuple[str, Mapping[str, Mapping[str, Any]]]]] = {
+    "DK": ("denmark", DK_CPR_REGISTRY),
+    "SE": ("sweden", SE_SPAR_REGISTRY),
+    "NO": ("norway", NO_FOLKEREGISTER),
+    "FI": ("finland", FI_POPULATION_REGISTRY),
+}
+
+# Índice único (país, national_id) -> (fuente, registro): una sola búsqueda por request.
+# La clave incluye el país para mantener la búsqueda acotada al registro pedido.
+# national_id en mayúsculas: la búsqueda no distingue mayúsculas ("fi-…" == "FI-…").
+ALL_REGISTRY: Final[Dict[Tuple[str, str], Tuple[str, Mapping[str, Any]]]] = {}
+for _country, (_source, _registry) in _REGISTRY_BY_COUNTRY.items():
+    for _nid, _rec in _registry.items():
+        ALL_REGISTRY[(_country, _nid.upper())] = (_source, _rec)
+del _country, _source, _registry, _nid, _rec
+
+# --- Respuestas de error pre-serializadas (forma fija) ---
+
+# Resultado de _handle: (payload, body JSON ya serializado o None)
+_Result = Tuple[Dict[str, Any], Optional[str]]
+
+def _error(reason: str) -> Dict[str, Any]:
+    return {"status": "ERROR", "reason": reason, "registry_record": None, "source": "unknown"}
+
+# Motivos de ERROR fijos -> body serializado una sola vez
+_ERROR_BODIES: Final[Dict[str, str]] = {
+    reason: orjson.dumps(_error(reason)).decode()
+    for reason in ("Invalid JSON input", "Event must be a JSON object", "nationalId is required")
+}
+
+def _error_result(reason: str) -> _Result:
+    return _error(reason), _ERROR_BODIES[reason]
+
 # --- Lógica principal (sin CORS) ---
 
-def handler(event, context):
+def _handle(event: Any) -> _Result:
     """
-    Lambda handler. Compatible con AWS Console (string o dict).
+    Lógica de handler. Devuelve (payload, body): los ERROR de motivo fijo traen además
+    su body JSON ya serializado; el resto trae body None.
     """
-    try:
-        # Si viene de API Gateway proxy
-        if isinstance(event, dict) and "body" in event:
-            try:
-                body = event["body"]
-                if isinstance(body, str) and body:
-                    event = json.loads(body)
-                elif isinstance(body, dict):
-                    event = body
-                else:
-                    event = {}
-            except Exception:
-                event = {}
-
-        # Si el evento viene como string JSON
-        if isinstance(event, str):
-            try:
-                event = json.loads(event)
-            except json.JSONDecodeError:
-                return {"status": "ERROR", "reason": "Invalid JSON input", "registry_record": None, "source": "unknown"}
-
-        if not isinstance(event, dict):
-            return {"status": "ERROR", "reason": "Event must be a JSON object", "registry_record": None, "source": "unknown"}
-
-        # --- Extraer campos ---
-        national_id = (event.get("nationalId") or "").strip()
-        country = normalize_country(event.get("country"))
-        firstName = event.get("firstName")
-        lastName = event.get("lastName")
-        dateOfBirth = event.get("dateOfBirth")
-
-        if not national_id:
-            return {"status": "ERROR", "reason": "nationalId is required", "registry_record": None, "source": "unknown"}
-
-        # --- Seleccionar registro por país ---
-        registry_map = {
-            "DK": ("denmark", DK_CPR_REGISTRY),
-            "SE": ("sweden", SE_SPAR_REGISTRY),
-            "NO": ("norway", NO_FOLKEREGISTER),
-            "FI": ("finland", FI_POPULATION_REGISTRY),
-        }
-
-        source_name, registry = registry_map.get(country, ("denmark", DK_CPR_REGISTRY))
-        person = registry.get(national_id)
-
-        if not person:
-            return {
-                "status": "NOT_FOUND",
-                "reason": f"ID {national_id} not found in {source_name} registry.",
-                "registry_record": None,
-                "source": source_name,
-            }
-
-        # --- Verificación opcional ---
+    # API Gateway proxy ({"body": ...}) o string JSON desde la consola.
+    # Solo el JSON parseado necesita volver a comprobarse como objeto.
+    raw: Optional[str] = None
+    if type(event) is dict:
+        if "body" in event:
+            body: Any = event["body"]
+            if type(body) is str and body:
+                raw = body
+            else:
+                event = body if type(body) is dict else {}
+    elif type(event) is str:
+        raw = event
+    else:
+        return _error_result("Event must be a JSON object")
+
+    if raw is not None:
+        try:
+            event = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return _error_result("Invalid JSON input")
+        if type(event) is not dict:
+            return _error_result("Event must be a JSON object")
+
+    # --- Extraer campos ---
+    national_id: str = (event.get("nationalId") or "").strip().upper()
+    country = normalize_country(event.get("country"))
+    firstName = event.get("firstName")
+    lastName = event.get("lastName")
+    dateOfBirth = event.get("dateOfBirth")
+
+    if not national_id:
+        return _error_result("nationalId is required")
+
+    # --- Buscar en el registro del país ---
+    hit = ALL_REGISTRY.get((country, national_id))
+
+    if not hit:
+        source_name = _REGISTRY_BY_COUNTRY[country][0]
+        return {
+            "status": "NOT_FOUND",
+            "reason": f"ID {national_id} not found in {source_name} registry.",
+            "registry_record": None,
+            "source": source_name,
+        }, None
+
+    source_name, person = hit
+
+    # --- Verificación opcional (la mayoría de requests solo traen el ID) ---
+    if firstName or lastName or dateOfBirth:
         mismatch_reason = compare_optional_fields(person, firstName, lastName, dateOfBirth)
-        if mismatch_reason:
-            return {
-                "status": "MISMATCH",
-                "reason": mismatch_reason,
-                "registry_record": {"national_id": national_id, **person},
-                "source": source_name,
-            }
-
-        # --- OK ---
+    else:
+        mismatch_reason = None
+    if mismatch_reason:
         return {
-            "status": "VERIFIED",
-            "reason": f"Found in {source_name} registry.",
-            "registry_record": {"national_id": national_id, **person},
+            "status": "MISMATCH",
+            "reason": mismatch_reason,
+            "registry_record": public_record(national_id, person),
             "source": source_name,
-        }
+        }, None
 
-    except Exception as e:
-        return {"status": "ERROR", "reason": str(e), "registry_record": None, "source": "unknown"}
+    # --- OK ---
+    return {
+        "status": "VERIFIED",
+        "reason": f"Found in {source_name} registry.",
+        "registry_record": public_record(national_id, person),
+        "source": source_name,
+    }, None
+
+def handler(event: Any, context: Any) -> Dict[str, Any]:
+    """
+    Lambda handler. Compatible con AWS Console (string o dict).
+    Las excepciones inesperadas se propagan; lambda_handler las convierte en ERROR.
+    nationalId no distingue mayúsculas/minúsculas; se devuelve en mayúsculas.
+    registry_record["citizenship"] es una tupla (en el body JSON sigue siendo una lista).
+    """
+    return _handle(event)[0]
 
 # --- Alias compatible con AWS Lambda (con CORS y OPTIONS) ---
 
-def lambda_handler(event, context):
+def lambda_handler(event: Any, context: Any) -> Dict[str, Any]:
     """Alias requerido por AWS Lambda"""
     if isinstance(event, dict) and event.get("httpMethod") == "OPTIONS":
-        return cors_response(200, {"ok": True})
+        return _OPTIONS_RESPONSE
 
-    payload = handler(event, context)
-    return cors_response(200, payload)
+    try:
+        payload, body = _handle(event)
+    except Exception as e:
+        # Entrada inesperada (p.ej. nationalId no string): mismo contrato de error
+        logger.exception("verify_identity failed")
+        payload, body = _error(str(e)), None
+    if body is None:
+        return cors_response(200, payload)
+    # Body ya serializado: sin pasar de nuevo por orjson
+    response = _OK_SHELL.copy()
+    response["body"] = body
+    return response